@@ -4,15 +4,18 @@ TwitRec - Twitch Stream Recorder
 Главный файл приложения
 """
 import sys
+import atexit
+import asyncio
 import time
 import signal
 import logging
-import json
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime
 
 from twitrec.utils.config import Config
+from twitrec.utils.log_handler import BufferedFileHandler
+from twitrec.utils import jsonlib
 from twitrec.api.twitch_client import TwitchAPIClient
 from twitrec.recorder.stream_recorder import StreamRecorder
 from twitrec.ui.cli_interface import CLIInterface
@@ -28,7 +31,24 @@ class TwitRec:
         self.twitch_client: TwitchAPIClient = None
         self.background_thread = None
         self.running = False
+        # Сигнал остановки фонового режима, прерывает ожидание между проверками
+        self._stop_event = threading.Event()
         self.watched_streamers = []
+        # Защищает изменения watched_streamers от гонки с фоновым мониторингом
+        self._watched_lock = threading.Lock()
+        # Пул потоков для параллельных запросов к Twitch API
+        self._executor = ThreadPoolExecutor(max_workers=8)
+
+        # Действия главного меню (выход обрабатывается отдельно в run)
+        self._menu_dispatch = {
+            "1": self.start_recording_action,
+            "2": self.stop_recording_action,
+            "3": self.show_active_recordings_action,
+            "4": self.search_channels_action,
+            "5": self.show_channel_info_action,
+            "6": self.settings_action,
+            "7": self.background_mode_action,
+        }
 
         # Настройка логирования
         self._setup_logging()
@@ -42,13 +62,16 @@ class TwitRec:
         log_dir = Path(self.config.get("logs_dir"))
         log_dir.mkdir(parents=True, exist_ok=True)
 
-        log_file = log_dir / f"twitrec_{datetime.now().strftime('%Y%m%d')}.log"
+        log_file = log_dir / f"twitrec_{time.strftime('%Y%m%d')}.log"
+
+        self._log_handler = BufferedFileHandler(log_file, encoding='utf-8')
+        atexit.register(self._log_handler.flush)
 
         logging.basicConfig(
             level=logging.INFO,
             format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
             handlers=[
-                logging.FileHandler(log_file, encoding='utf-8'),
+                self._log_handler,
                 logging.StreamHandler()
             ]
         )
@@ -59,8 +82,14 @@ class TwitRec:
         """Обработчик сигналов для корректного завершения"""
         self.ui.show_warning("Получен сигнал завершения, останавливаю записи...")
         self.running = False
+        self._stop_event.set()
         if self.recorder:
             self.recorder.stop_all_recordings()
+        self._executor.shutdown(wait=False)
+        if self.twitch_client:
+            self.twitch_client.close()
+        self.config.flush()
+        self._log_handler.flush()
         sys.exit(0)
 
     def _initialize_api_client(self) -> bool:
@@ -82,7 +111,7 @@ class TwitRec:
                 return False
 
         try:
-            self.twitch_client = TwitchAPIClient(client_id, client_secret)
+            self.twitch_client = TwitchAPIClient(client_id, client_secret, self.config.config_dir)
             # Тест соединения
             self.twitch_client._get_access_token()
             return True
@@ -109,14 +138,16 @@ class TwitRec:
         # Проверить что стрим онлайн
         self.ui.show_loading("Проверка статуса стрима")
 
-        if not self.twitch_client.is_stream_live(streamer):
+        # Явное действие пользователя - статус запрашиваем в обход кэша
+        if not self.twitch_client.is_stream_live(streamer, use_cache=False):
             self.ui.show_warning(f"Стрим {streamer} сейчас не онлайн")
             if not self.ui.confirm("Начать запись при появлении онлайн?"):
                 return
 
             # Добавить в список отслеживаемых
             if streamer not in self.watched_streamers:
-                self.watched_streamers.append(streamer)
+                with self._watched_lock:
+                    self.watched_streamers.append(streamer)
                 self._save_watched_streamers()
                 self.ui.show_success(f"Стример {streamer} добавлен в список отслеживания")
             return
@@ -149,10 +180,7 @@ class TwitRec:
             self.ui.show_warning("Нет активных записей")
             return
 
-        self.ui.show_active_recordings({
-            streamer: self.recorder.get_recording_info(streamer)
-            for streamer in active.keys()
-        })
+        self.ui.show_active_recordings(self._recordings_info(active))
 
         streamer = self.ui.get_streamer_name()
         if not streamer:
@@ -171,12 +199,16 @@ class TwitRec:
             self.ui.show_info("Нет активных записей")
             return
 
-        recordings_info = {
-            streamer: self.recorder.get_recording_info(streamer)
-            for streamer in active.keys()
-        }
+        self.ui.show_active_recordings(self._recordings_info(active))
 
-        self.ui.show_active_recordings(recordings_info)
+    def _recordings_info(self, active: dict) -> dict:
+        """Информация об активных записях для отображения"""
+        recordings_info = {}
+        for streamer in active.keys():
+            info = self.recorder.get_recording_info(streamer)
+            if info:
+                recordings_info[streamer] = info
+        return recordings_info
 
     def search_channels_action(self):
         """Действие: поиск каналов"""
@@ -198,13 +230,17 @@ class TwitRec:
 
         self.ui.show_loading("Получение информации")
 
+        # Запросы независимы - выполняем их параллельно
+        channel_future = self._executor.submit(self.twitch_client.get_channel_info, streamer)
+        stream_future = self._executor.submit(self.twitch_client.get_stream_info, streamer)
+
         # Информация о канале
-        channel_info = self.twitch_client.get_channel_info(streamer)
+        channel_info = channel_future.result()
         if channel_info:
             self.ui.show_channel_info(channel_info)
 
         # Проверка статуса стрима
-        stream_info = self.twitch_client.get_stream_info(streamer)
+        stream_info = stream_future.result()
         if stream_info:
             self.ui.show_info("🔴 Стрим сейчас ОНЛАЙН")
             self.ui.show_stream_info(stream_info)
@@ -260,47 +296,125 @@ class TwitRec:
     def _save_watched_streamers(self):
         """Сохранить список отслеживаемых стримеров"""
         watched_file = self.config.config_dir / "watched.json"
-        with open(watched_file, 'w', encoding='utf-8') as f:
-            json.dump(self.watched_streamers, f)
+        with self._watched_lock:
+            data = jsonlib.dumps(self.watched_streamers)
+        watched_file.write_bytes(data)
 
     def _load_watched_streamers(self):
         """Загрузить список отслеживаемых стримеров"""
         watched_file = self.config.config_dir / "watched.json"
         if watched_file.exists():
-            with open(watched_file, 'r', encoding='utf-8') as f:
-                self.watched_streamers = json.load(f)
+            watched = jsonlib.loads(watched_file.read_bytes())
+            with self._watched_lock:
+                self.watched_streamers = watched
+
+    def _watched_snapshot(self) -> tuple:
+        """Неизменяемый снимок списка отслеживаемых стримеров"""
+        with self._watched_lock:
+            return tuple(self.watched_streamers)
+
+    def _auto_start_recording(self, streamer: str):
+        """Начать запись онлайн стримера, если она еще не идет"""
+        if not self.recorder.is_recording(streamer):
+            # Стрим онлайн, но не записывается
+            quality = self.config.get('default_quality', 'best')
+            success = self.recorder.start_recording(
+                streamer=streamer,
+                quality=quality,
+                filename_template=self.config.get("filename_template")
+            )
+            if success:
+                self.logger.info("Автоматически начата запись %s", streamer)
+
+    def _auto_stop_recording(self, streamer: str):
+        """Остановить запись завершившегося стрима"""
+        if self.recorder.is_recording(streamer):
+            # Останавливаем запись
+            self.recorder.stop_recording(streamer)
+            self.logger.info("Стрим %s завершен, запись остановлена", streamer)
 
     def _background_monitor(self):
         """Фоновый мониторинг стримеров"""
         self.ui.show_info("Фоновый режим активирован")
+
+        if self.config.get('use_eventsub', False):
+            try:
+                asyncio.run(self._eventsub_monitor())
+                return
+            except Exception as e:
+                self.logger.error("EventSub недоступен, переключаюсь на опрос API: %s", e)
+
+        self._polling_monitor()
+
+    def _submit_background(self, fn, streamer: str):
+        """Выполнить действие над записью стримера в пуле потоков"""
+        try:
+            future = self._executor.submit(fn, streamer)
+        except RuntimeError:
+            # Пул уже остановлен - приложение завершается
+            return
+        future.add_done_callback(self._log_future_error)
+
+    def _log_future_error(self, future):
+        """Записать в лог исключение из задачи пула потоков"""
+        error = future.exception()
+        if error is not None:
+            self.logger.error("Ошибка фоновой задачи: %s", error)
+
+    async def _eventsub_monitor(self):
+        """Мониторинг через EventSub: Twitch сам сообщает о начале и конце стрима"""
+        # Колбэки вызываются в потоке EventSub, запись запускаем в пуле потоков
+        def on_online(login: str):
+            self._submit_background(self._auto_start_recording, login)
+
+        def on_offline(login: str):
+            self._submit_background(self._auto_stop_recording, login)
+
+        user_ids = []
+        watched = self._watched_snapshot()
+        for streamer in watched:
+            user_id = self.twitch_client.get_user_id(streamer)
+            if user_id:
+                user_ids.append(user_id)
+            else:
+                self.logger.warning("Не удалось получить ID стримера %s", streamer)
+
+        try:
+            await self.twitch_client.subscribe_stream_events(user_ids, on_online, on_offline)
+
+            # Подписка не сообщает о стримах, которые уже идут - проверяем их один раз
+            live_streams = self.twitch_client.get_streams_info(watched)
+            for login in live_streams:
+                on_online(login)
+
+            while not self._stop_event.is_set():
+                await asyncio.sleep(1)
+        finally:
+            await self.twitch_client.unsubscribe_stream_events()
+
+    def _polling_monitor(self):
+        """Мониторинг периодическим опросом API"""
         check_interval = self.config.get('check_interval', 60)
 
         while self.running:
-            for streamer in self.watched_streamers[:]:  # Копия списка
+            watched = self._watched_snapshot()
+            # Один запрос /streams на всех отслеживаемых вместо запроса на каждого
+            live_streams = self.twitch_client.get_streams_info(watched)
+
+            for streamer in watched:
                 try:
-                    if self.twitch_client.is_stream_live(streamer):
-                        if not self.recorder.is_recording(streamer):
-                            # Стрим онлайн, но не записывается
-                            quality = self.config.get('default_quality', 'best')
-                            success = self.recorder.start_recording(
-                                streamer=streamer,
-                                quality=quality,
-                                filename_template=self.config.get("filename_template")
-                            )
-                            if success:
-                                self.logger.info(f"Автоматически начата запись {streamer}")
+                    if streamer.lower() in live_streams:
+                        self._auto_start_recording(streamer)
                     else:
                         # Стрим оффлайн
-                        if self.recorder.is_recording(streamer):
-                            # Останавливаем запись
-                            self.recorder.stop_recording(streamer)
-                            self.logger.info(f"Стрим {streamer} завершен, запись остановлена")
+                        self._auto_stop_recording(streamer)
 
                 except Exception as e:
-                    self.logger.error(f"Ошибка мониторинга {streamer}: {e}")
+                    self.logger.error("Ошибка мониторинга %s: %s", streamer, e)
 
             # Ждем перед следующей проверкой
-            time.sleep(check_interval)
+            if self._stop_event.wait(check_interval):
+                break
 
     def background_mode_action(self):
         """Действие: фоновый режим"""
@@ -311,7 +425,8 @@ class TwitRec:
                 while True:
                     streamer = self.ui.get_streamer_name()
                     if streamer and streamer not in self.watched_streamers:
-                        self.watched_streamers.append(streamer)
+                        with self._watched_lock:
+                            self.watched_streamers.append(streamer)
                         self.ui.show_success(f"Добавлен {streamer}")
 
                     if not self.ui.confirm("Добавить еще?"):
@@ -326,6 +441,7 @@ class TwitRec:
 
         if self.ui.confirm("Запустить фоновый мониторинг?"):
             self.running = True
+            self._stop_event.clear()
             self.background_thread = threading.Thread(target=self._background_monitor, daemon=True)
             self.background_thread.start()
 
@@ -334,10 +450,10 @@ class TwitRec:
             self.ui.show_info("Нажмите Ctrl+C для остановки")
 
             try:
-                while self.running:
-                    time.sleep(1)
+                self._stop_event.wait()
             except KeyboardInterrupt:
                 self.running = False
+                self._stop_event.set()
                 self.ui.show_info("Остановка фонового режима...")
 
     def run(self):
@@ -360,23 +476,13 @@ class TwitRec:
             try:
                 choice = self.ui.show_menu()
 
-                if choice == "1":
-                    self.start_recording_action()
-                elif choice == "2":
-                    self.stop_recording_action()
-                elif choice == "3":
-                    self.show_active_recordings_action()
-                elif choice == "4":
-                    self.search_channels_action()
-                elif choice == "5":
-                    self.show_channel_info_action()
-                elif choice == "6":
-                    self.settings_action()
-                elif choice == "7":
-                    self.background_mode_action()
+                action = self._menu_dispatch.get(choice)
+                if action:
+                    action()
                 elif choice == "8":
                     if self.ui.confirm("Вы уверены что хотите выйти?"):
                         self.recorder.stop_all_recordings()
+                        self.config.flush()
                         self.ui.show_success("До свидания!")
                         break
 
@@ -388,6 +494,7 @@ class TwitRec:
                 self.ui.show_warning("\nПрервано пользователем")
                 if self.ui.confirm("Выйти из приложения?"):
                     self.recorder.stop_all_recordings()
+                    self.config.flush()
                     break
             except Exception as e:
                 self.ui.show_error(f"Ошибка: {e}")
@@ -6,7 +6,8 @@ from pathlib import Path
 
 # Read the contents of README file
 this_directory = Path(__file__).parent
-long_description = (this_directory / "README.md").read_text(encoding='utf-8')
+with open(this_directory / "README.md", 'rb') as f:
+    long_description = f.read().decode('utf-8')
 
 setup(
     name='twitrec',
@@ -30,12 +31,13 @@ setup(
     ],
     python_requires='>=3.8',
     install_requires=[
-        'requests>=2.31.0',
+        'httpx[http2]>=0.25.0',
         'rich>=13.7.0',
         'streamlink>=6.5.0',
         'python-dotenv>=1.0.0',
         'click>=8.1.7',
         'twitchAPI>=4.1.0',
+        'orjson>=3.9.0',
     ],
     entry_points={
         'console_scripts': [
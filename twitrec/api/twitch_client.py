@@ -1,29 +1,145 @@
 """
 Клиент для работы с Twitch API
 """
-import requests
-from typing import Optional, Dict, List
-from datetime import datetime, timedelta
+import time
+import logging
+import threading
+import httpx
+from pathlib import Path
+from typing import Optional, Dict, List, Tuple, Any, Callable, Sequence
+from twitchAPI.twitch import Twitch
+from twitchAPI.oauth import UserAuthenticator
+from twitchAPI.eventsub.websocket import EventSubWebsocket
+
+from twitrec.utils import jsonlib
+from twitrec.utils.fs import write_atomic
 
 
 class TwitchAPIClient:
     """Клиент для взаимодействия с Twitch API"""
 
     API_BASE_URL = "https://api.twitch.tv/helix"
+    # Максимум user_login в одном запросе /streams
+    STREAMS_BATCH_SIZE = 100
     TOKEN_URL = "https://id.twitch.tv/oauth2/token"
 
-    def __init__(self, client_id: str, client_secret: str):
+    # Повтор запросов при перегрузке или ошибках сервера
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 0.3  # секунды, удваивается с каждой попыткой
+
+    # Время жизни кэша ответов (секунды)
+    USER_CACHE_TTL = 24 * 60 * 60  # user_id никогда не меняется
+    STREAM_CACHE_TTL = 30  # Twitch сам обновляет статус стрима раз в ~минуту
+    CHANNEL_CACHE_TTL = 5 * 60
+
+    def __init__(self, client_id: str, client_secret: str, config_dir: Optional[Path] = None):
         self.client_id = client_id
         self.client_secret = client_secret
+        self.config_dir = Path(config_dir) if config_dir else None
+        self.logger = logging.getLogger(__name__)
         self.access_token: Optional[str] = None
-        self.token_expires: Optional[datetime] = None
+        # Время истечения токена по time.monotonic()
+        self.token_expires_monotonic: float = 0.0
+        # Заголовки с текущим токеном, пересобираются только при его обновлении
+        self._headers_cache: Optional[Dict[str, str]] = None
+        # Истекший токен обновляет только один поток, остальные ждут результат
+        self._token_lock = threading.Lock()
+
+        # Постоянный HTTP/2 клиент: параллельные запросы мультиплексируются в одном TLS соединении
+        # http2 и limits задаются только транспорту: при явном transport
+        # httpx.Client игнорирует эти параметры, поэтому у клиента их нет
+        self.http = httpx.Client(
+            timeout=10.0,
+            transport=httpx.HTTPTransport(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=10),
+                retries=3
+            ),
+            headers={'Client-ID': self.client_id}
+        )
+
+        # Кэш ответов: (эндпоинт, ключ) -> (время получения, результат)
+        self._cache: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+
+        # Постоянный кэш логин -> user_id (ID пользователей не меняются)
+        self._user_ids_lock = threading.Lock()
+        self._user_id_cache: Dict[str, str] = self._load_user_ids()
+
+        # Клиенты EventSub, создаются при подписке на события
+        self._eventsub_twitch: Optional[Twitch] = None
+        self._eventsub: Optional[EventSubWebsocket] = None
+
+    def _cached(self, key: Tuple[str, str], ttl: float, fn: Callable[[], Any]) -> Any:
+        """Вернуть результат из кэша, если он не старше ttl, иначе вызвать fn
+
+        Пустые результаты (None) не кэшируются, чтобы ошибки запросов
+        не запоминались.
+        """
+        now = time.monotonic()
+        entry = self._cache.get(key)
+        if entry is not None and now - entry[0] < ttl:
+            return entry[1]
+
+        result = fn()
+        if result is not None:
+            self._cache[key] = (now, result)
+        return result
+
+    def _config_path(self, name: str) -> Optional[Path]:
+        """Путь к файлу в директории конфигурации"""
+        if self.config_dir is None:
+            return None
+        return self.config_dir / name
+
+    def _load_user_ids(self) -> Dict[str, str]:
+        """Загрузить кэш user_id с диска"""
+        user_ids_file = self._config_path("user_ids.json")
+        if user_ids_file is None or not user_ids_file.exists():
+            return {}
+
+        try:
+            return jsonlib.loads(user_ids_file.read_bytes())
+        except (OSError, ValueError):
+            return {}
+
+    def _save_user_id(self, username: str, user_id: str):
+        """Запомнить user_id и атомарно сохранить кэш на диск"""
+        with self._user_ids_lock:
+            if self._user_id_cache.get(username) == user_id:
+                return
+            self._user_id_cache[username] = user_id
+
+            user_ids_file = self._config_path("user_ids.json")
+            if user_ids_file is None:
+                return
+
+            try:
+                write_atomic(user_ids_file, jsonlib.dumps(self._user_id_cache))
+            except OSError as e:
+                self.logger.warning("Ошибка сохранения кэша user_id: %s", e)
+
+    def close(self):
+        """Закрыть HTTP клиент"""
+        self.http.close()
 
     def _get_access_token(self) -> str:
         """Получить access token"""
         # Проверить существующий токен
-        if self.access_token and self.token_expires:
-            if datetime.now() < self.token_expires:
+        if self.access_token and time.monotonic() < self.token_expires_monotonic:
+            return self.access_token
+
+        with self._token_lock:
+            # Пока ждали блокировку, токен мог обновить другой поток
+            if self.access_token and time.monotonic() < self.token_expires_monotonic:
                 return self.access_token
+            return self._fetch_access_token()
+
+    def _fetch_access_token(self) -> str:
+        """Загрузить сохраненный или получить новый токен, вызывается под self._token_lock"""
+        # Токен приложения живет ~60 дней - пробуем взять сохраненный с прошлого запуска
+        if self.access_token is None and self._load_token():
+            return self.access_token
 
         # Получить новый токен
         params = {
@@ -32,96 +148,249 @@ class TwitchAPIClient:
             'grant_type': 'client_credentials'
         }
 
-        response = requests.post(self.TOKEN_URL, params=params)
+        response = self.http.post(self.TOKEN_URL, params=params)
         response.raise_for_status()
 
-        data = response.json()
-        self.access_token = data['access_token']
+        data = jsonlib.loads(response.content)
 
         # Установить время истечения (с запасом в 60 секунд)
         expires_in = data.get('expires_in', 3600)
-        self.token_expires = datetime.now() + timedelta(seconds=expires_in - 60)
+        self._set_token(data['access_token'], expires_in - 60)
+        self._save_token(time.time() + expires_in - 60)
 
         return self.access_token
 
+    def _set_token(self, token: str, expires_in: float):
+        """Установить текущий токен, истекающий через expires_in секунд"""
+        self.access_token = token
+        # Client-ID уже установлен в заголовках клиента
+        self._headers_cache = {'Authorization': f'Bearer {token}'}
+        self.token_expires_monotonic = time.monotonic() + expires_in
+
+    def _load_token(self) -> bool:
+        """Загрузить сохраненный токен, если он еще действителен"""
+        token_file = self._config_path("token.json")
+        if token_file is None or not token_file.exists():
+            return False
+
+        try:
+            data = jsonlib.loads(token_file.read_bytes())
+        except (OSError, ValueError):
+            return False
+
+        # Токен выдан для других креденшалов
+        if data.get('client_id') != self.client_id:
+            return False
+
+        # Время истечения хранится по системным часам: monotonic не переживает перезагрузку
+        expires_in = data.get('expires_at', 0) - time.time()
+        if expires_in <= 0 or not data.get('token'):
+            return False
+
+        self._set_token(data['token'], expires_in)
+        return True
+
+    def _invalidate_token(self, rejected_headers: Dict[str, str]):
+        """Сбросить отклоненный токен и удалить сохраненную копию
+
+        Если токен уже обновил другой поток, новый токен не сбрасывается.
+        """
+        with self._token_lock:
+            if self._headers_cache is not rejected_headers:
+                return
+
+            self.access_token = None
+            self.token_expires_monotonic = 0.0
+
+            token_file = self._config_path("token.json")
+            if token_file is not None:
+                try:
+                    token_file.unlink()
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    self.logger.warning("Ошибка удаления токена: %s", e)
+
+    def _save_token(self, expires_at: float):
+        """Сохранить текущий токен на диск (доступ только владельцу)"""
+        token_file = self._config_path("token.json")
+        if token_file is None:
+            return
+
+        data = {
+            'client_id': self.client_id,
+            'token': self.access_token,
+            'expires_at': expires_at
+        }
+
+        try:
+            write_atomic(token_file, jsonlib.dumps(data), mode=0o600)
+        except OSError as e:
+            self.logger.warning("Ошибка сохранения токена: %s", e)
+
     def _get_headers(self) -> Dict[str, str]:
         """Получить заголовки для API запросов"""
-        return {
-            'Client-ID': self.client_id,
-            'Authorization': f'Bearer {self._get_access_token()}'
-        }
+        self._get_access_token()
+        return self._headers_cache
 
-    def get_user_info(self, username: str) -> Optional[Dict]:
-        """Получить информацию о пользователе"""
-        url = f"{self.API_BASE_URL}/users"
-        params = {'login': username}
+    def _api_get(self, endpoint: str, params: Sequence[Tuple[str, Any]]) -> List[Dict]:
+        """Выполнить GET запрос к Helix API и вернуть поле data
+
+        Параметры передаются кортежем пар (ключ, значение), без словаря на
+        каждый запрос. При ошибке запроса пишет предупреждение в лог и
+        возвращает пустой список.
+        """
+        url = f"{self.API_BASE_URL}/{endpoint}"
 
         try:
-            response = requests.get(url, headers=self._get_headers(), params=params)
+            for attempt in range(self.MAX_RETRIES + 1):
+                headers = self._get_headers()
+                response = self.http.get(url, headers=headers, params=params)
+                if response.status_code == 401 and attempt == 0:
+                    # Сохраненный токен мог быть отозван - получаем новый
+                    self._invalidate_token(headers)
+                    continue
+                if response.status_code not in self.RETRY_STATUSES or attempt == self.MAX_RETRIES:
+                    break
+                time.sleep(self.RETRY_BACKOFF * 2 ** attempt)
+
             response.raise_for_status()
+            return jsonlib.loads(response.content).get('data', [])
+        except (httpx.HTTPError, ValueError) as e:
+            self.logger.warning("Ошибка запроса %s: %s", endpoint, e)
+            return []
 
-            data = response.json()
-            if data['data']:
-                return data['data'][0]
-            return None
-        except requests.RequestException as e:
-            print(f"Ошибка получения информации о пользователе: {e}")
+    def get_user_info(self, username: str, use_cache: bool = True) -> Optional[Dict]:
+        """Получить информацию о пользователе"""
+        return self._cached(
+            ('users', username.lower()),
+            self.USER_CACHE_TTL if use_cache else 0,
+            lambda: self._fetch_user_info(username)
+        )
+
+    def get_user_id(self, username: str) -> Optional[str]:
+        """Получить ID пользователя по логину"""
+        user_id = self._user_id_cache.get(username.lower())
+        if user_id:
+            return user_id
+
+        user_info = self.get_user_info(username)
+        return user_info['id'] if user_info else None
+
+    def _fetch_user_info(self, username: str) -> Optional[Dict]:
+        """Запросить информацию о пользователе из API"""
+        data = self._api_get("users", (('login', username),))
+        if not data:
             return None
 
-    def is_stream_live(self, username: str) -> bool:
+        user_info = data[0]
+        self._save_user_id(username.lower(), user_info['id'])
+        return user_info
+
+    def is_stream_live(self, username: str, use_cache: bool = True) -> bool:
         """Проверить идет ли стрим"""
-        stream_info = self.get_stream_info(username)
+        stream_info = self.get_stream_info(username, use_cache=use_cache)
         return stream_info is not None
 
-    def get_stream_info(self, username: str) -> Optional[Dict]:
+    def get_stream_info(self, username: str, use_cache: bool = True) -> Optional[Dict]:
         """Получить информацию о стриме"""
-        url = f"{self.API_BASE_URL}/streams"
-        params = {'user_login': username}
+        return self._cached(
+            ('streams', username.lower()),
+            self.STREAM_CACHE_TTL if use_cache else 0,
+            lambda: self._fetch_stream_info(username)
+        )
 
-        try:
-            response = requests.get(url, headers=self._get_headers(), params=params)
-            response.raise_for_status()
+    def _fetch_stream_info(self, username: str) -> Optional[Dict]:
+        """Запросить информацию о стриме из API"""
+        data = self._api_get("streams", (('user_login', username),))
+        return data[0] if data else None
 
-            data = response.json()
-            if data['data']:
-                return data['data'][0]
-            return None
-        except requests.RequestException as e:
-            print(f"Ошибка получения информации о стриме: {e}")
-            return None
+    def get_streams_info(self, usernames: Sequence[str]) -> Dict[str, Dict]:
+        """Получить информацию о стримах нескольких пользователей
 
-    def get_channel_info(self, username: str) -> Optional[Dict]:
-        """Получить информацию о канале"""
-        user_info = self.get_user_info(username)
-        if not user_info:
-            return None
+        Возвращает словарь {логин в нижнем регистре: информация о стриме}
+        только для тех, кто сейчас онлайн.
+        """
+        streams: Dict[str, Dict] = {}
 
-        url = f"{self.API_BASE_URL}/channels"
-        params = {'broadcaster_id': user_info['id']}
+        for batch in self._chunks(usernames, self.STREAMS_BATCH_SIZE):
+            params = tuple(('user_login', username) for username in batch) + (('first', len(batch)),)
 
-        try:
-            response = requests.get(url, headers=self._get_headers(), params=params)
-            response.raise_for_status()
+            now = time.monotonic()
+            for stream in self._api_get("streams", params):
+                login = stream['user_login'].lower()
+                streams[login] = stream
+                self._cache[('streams', login)] = (now, stream)
 
-            data = response.json()
-            if data['data']:
-                return data['data'][0]
-            return None
-        except requests.RequestException as e:
-            print(f"Ошибка получения информации о канале: {e}")
+        return streams
+
+    @staticmethod
+    def _chunks(items: Sequence[str], size: int):
+        """Разбить список на части не больше size элементов"""
+        for i in range(0, len(items), size):
+            yield items[i:i + size]
+
+    def get_channel_info(self, username: str, use_cache: bool = True) -> Optional[Dict]:
+        """Получить информацию о канале"""
+        return self._cached(
+            ('channels', username.lower()),
+            self.CHANNEL_CACHE_TTL if use_cache else 0,
+            lambda: self._fetch_channel_info(username)
+        )
+
+    def _fetch_channel_info(self, username: str) -> Optional[Dict]:
+        """Запросить информацию о канале из API"""
+        user_id = self.get_user_id(username)
+        if not user_id:
             return None
 
+        data = self._api_get("channels", (('broadcaster_id', user_id),))
+        return data[0] if data else None
+
     def search_channels(self, query: str, limit: int = 10) -> List[Dict]:
         """Поиск каналов по запросу"""
-        url = f"{self.API_BASE_URL}/search/channels"
-        params = {'query': query, 'first': limit}
+        return self._api_get("search/channels", (('query', query), ('first', limit)))
 
-        try:
-            response = requests.get(url, headers=self._get_headers(), params=params)
-            response.raise_for_status()
+    async def subscribe_stream_events(
+        self,
+        user_ids: List[str],
+        on_online: Callable[[str], None],
+        on_offline: Callable[[str], None]
+    ):
+        """Подписаться на события stream.online/stream.offline через EventSub
 
-            data = response.json()
-            return data.get('data', [])
-        except requests.RequestException as e:
-            print(f"Ошибка поиска каналов: {e}")
-            return []
+        Колбэки получают логин стримера. WebSocket транспорт требует
+        пользовательский токен, поэтому при подписке откроется браузер
+        для авторизации.
+        """
+        twitch = await Twitch(self.client_id, self.client_secret)
+        # Сохраняем сразу, чтобы unsubscribe_stream_events закрыл сессию,
+        # даже если авторизация или запуск WebSocket завершатся ошибкой
+        self._eventsub_twitch = twitch
+
+        auth = UserAuthenticator(twitch, [], force_verify=False)
+        token, refresh_token = await auth.authenticate()
+        await twitch.set_user_authentication(token, [], refresh_token)
+
+        eventsub = EventSubWebsocket(twitch)
+        eventsub.start()
+        self._eventsub = eventsub
+
+        async def handle_online(event):
+            on_online(event.event.broadcaster_user_login)
+
+        async def handle_offline(event):
+            on_offline(event.event.broadcaster_user_login)
+
+        for user_id in user_ids:
+            await eventsub.listen_stream_online(user_id, handle_online)
+            await eventsub.listen_stream_offline(user_id, handle_offline)
+
+    async def unsubscribe_stream_events(self):
+        """Отписаться от событий EventSub и закрыть соединение"""
+        if self._eventsub:
+            await self._eventsub.stop()
+            self._eventsub = None
+        if self._eventsub_twitch:
+            await self._eventsub_twitch.close()
+            self._eventsub_twitch = None
@@ -3,13 +3,37 @@
 """
 import subprocess
 import os
+import shutil
+import select
 import signal
+import threading
+import time
+import functools
+import re
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Dict
 import logging
 
 
+# Переменные шаблона имени файла
+TEMPLATE_FIELDS = ('streamer', 'date', 'time', 'timestamp')
+
+# Известная переменная шаблона или одиночная фигурная скобка
+_TPL_RE = re.compile(r"\{(?:%s)\}|[{}]" % "|".join(TEMPLATE_FIELDS))
+
+
+@functools.lru_cache(maxsize=16)
+def _compile_template(template: str) -> str:
+    """Перевести шаблон имени файла в строку для str.format
+
+    Фигурные скобки вокруг неизвестных имен экранируются и остаются в имени
+    файла как есть. Результат кэшируется, шаблон разбирается один раз.
+    """
+    # Один проход: переменные остаются как есть, прочие скобки удваиваются
+    return _TPL_RE.sub(lambda m: m.group(0) if len(m.group(0)) > 1 else m.group(0) * 2, template)
+
+
 class StreamRecorder:
     """Класс для записи стримов через streamlink"""
 
@@ -27,30 +51,177 @@ class StreamRecorder:
         "audio_only"
     ]
 
+    # Сколько секунд ждать завершения streamlink после SIGTERM
+    STOP_TIMEOUT = 10
+
     def __init__(self, recordings_dir: str, logs_dir: str):
         self.recordings_dir = Path(recordings_dir)
         self.logs_dir = Path(logs_dir)
         self.active_recordings: Dict[str, subprocess.Popen] = {}
+        # Защищает active_recordings и pidfd: к ним обращаются меню,
+        # фоновый мониторинг и обработчики EventSub из разных потоков
+        self._lock = threading.Lock()
 
         # Настройка логирования
         self.logger = logging.getLogger(__name__)
 
-    def _generate_filename(self, streamer: str, template: str) -> str:
-        """Генерировать имя файла для записи"""
-        now = datetime.now()
+        # Способ остановки процессов выбирается один раз под платформу
+        if os.name != 'nt':
+            self._terminate = self._terminate_posix
+            self._kill = self._kill_posix
+        else:
+            self._terminate = self._terminate_windows
+            self._kill = self._kill_windows
+
+        # Абсолютный путь к streamlink ищется в PATH один раз
+        self._streamlink_path = shutil.which("streamlink")
+        if not self._streamlink_path:
+            self.logger.warning("streamlink не найден в PATH")
+
+        # На Linux >= 5.3 завершение процессов отслеживается через pidfd + epoll:
+        # один системный вызов на проверку вместо poll() каждого процесса
+        self._epoll = None
+        self._pidfds: Dict[str, int] = {}
+        self._pidfd_streamers: Dict[int, str] = {}
+        if hasattr(os, 'pidfd_open') and hasattr(select, 'epoll'):
+            self._epoll = select.epoll()
+
+    @staticmethod
+    def _terminate_posix(process: subprocess.Popen):
+        """Отправить SIGTERM группе процессов streamlink"""
+        os.killpg(os.getpgid(process.pid), signal.SIGTERM)
+
+    @staticmethod
+    def _kill_posix(process: subprocess.Popen):
+        """Отправить SIGKILL группе процессов streamlink"""
+        os.killpg(os.getpgid(process.pid), signal.SIGKILL)
+
+    @staticmethod
+    def _terminate_windows(process: subprocess.Popen):
+        """Завершить процесс streamlink"""
+        process.terminate()
+
+    @staticmethod
+    def _kill_windows(process: subprocess.Popen):
+        """Принудительно завершить процесс streamlink"""
+        process.kill()
+
+    def _watch_process(self, streamer: str, process: subprocess.Popen):
+        """Начать отслеживать завершение процесса записи"""
+        if self._epoll is None:
+            return
 
-        replacements = {
-            '{streamer}': streamer,
-            '{date}': now.strftime('%Y-%m-%d'),
-            '{time}': now.strftime('%H-%M-%S'),
-            '{timestamp}': str(int(now.timestamp()))
-        }
+        try:
+            fd = os.pidfd_open(process.pid)
+        except OSError as e:
+            self.logger.warning("pidfd_open недоступен, переключаюсь на poll(): %s", e)
+            self._close_epoll()
+            return
+
+        self._epoll.register(fd, select.EPOLLIN)
+        self._pidfds[streamer] = fd
+        self._pidfd_streamers[fd] = streamer
+
+    def _unwatch_process(self, streamer: str):
+        """Перестать отслеживать процесс записи"""
+        fd = self._pidfds.pop(streamer, None)
+        if fd is None:
+            return
+
+        self._pidfd_streamers.pop(fd, None)
+        self._epoll.unregister(fd)
+        os.close(fd)
+
+    def _close_epoll(self):
+        """Отказаться от epoll и вернуться к опросу процессов"""
+        for streamer in list(self._pidfds):
+            self._unwatch_process(streamer)
+        self._epoll.close()
+        self._epoll = None
+
+    def _detach_recording(self, streamer: str):
+        """Забрать запись из активных для остановки
+
+        Вызывается под self._lock. pidfd снимается с epoll, но не
+        закрывается: по нему ожидается завершение процесса, закрыть его
+        должен вызывающий.
+        """
+        recording = self.active_recordings.pop(streamer)
+        fd = self._pidfds.pop(streamer, None)
+        if fd is not None:
+            self._pidfd_streamers.pop(fd, None)
+            self._epoll.unregister(fd)
+        return recording, fd
+
+    @staticmethod
+    def _wait_with_timeout(process: subprocess.Popen, fd: Optional[int], timeout: float):
+        """Дождаться завершения процесса записи
+
+        С pidfd ожидание просыпается сразу при выходе процесса, без цикла
+        waitpid с нарастающими паузами внутри Popen.wait(). Как и
+        Popen.wait(), по таймауту бросает subprocess.TimeoutExpired.
+        """
+        if fd is None:
+            process.wait(timeout=timeout)
+            return
+
+        ready, _, _ = select.select([fd], [], [], timeout)
+        if not ready:
+            raise subprocess.TimeoutExpired(process.args, timeout)
+
+        # Процесс уже завершен, wait() только забирает код возврата
+        process.wait()
+
+    def _remove_recording(self, streamer: str):
+        """Удалить запись из списка активных
+
+        Запись могла быть уже удалена другим вызовом - это не ошибка.
+        """
+        self._unwatch_process(streamer)
+        self.active_recordings.pop(streamer, None)
+
+    def _reap_finished(self):
+        """Удалить из активных записи, процессы которых завершились
+
+        Вызывается под self._lock.
+        """
+        finished = []
+        unwatched = len(self.active_recordings)
+
+        if self._epoll is not None:
+            # Готовы только pidfd завершившихся процессов
+            for fd, _ in self._epoll.poll(0):
+                streamer = self._pidfd_streamers[fd]
+                self.active_recordings[streamer]['process'].wait()
+                finished.append(streamer)
+            unwatched -= len(self._pidfds)
 
-        filename = template
-        for key, value in replacements.items():
-            filename = filename.replace(key, value)
+        # Процессы без pidfd опрашиваем по одному; если все под epoll - проход не нужен
+        if unwatched:
+            finished.extend(
+                streamer for streamer, recording in self.active_recordings.items()
+                if streamer not in self._pidfds and recording['process'].poll() is not None
+            )
 
-        return filename
+        for streamer in finished:
+            self._remove_recording(streamer)
+
+    def _generate_filename(
+        self,
+        streamer: str,
+        template: str,
+        now: Optional[datetime] = None
+    ) -> str:
+        """Генерировать имя файла для записи"""
+        if now is None:
+            now = datetime.now()
+
+        return _compile_template(template).format(
+            streamer=streamer,
+            date=now.strftime('%Y-%m-%d'),
+            time=now.strftime('%H-%M-%S'),
+            timestamp=int(now.timestamp())
+        )
 
     def start_recording(
         self,
@@ -59,13 +230,30 @@ class StreamRecorder:
         filename_template: str = "{streamer}_{date}_{time}.mp4"
     ) -> bool:
         """Начать запись стрима"""
+        # Логины Twitch не зависят от регистра, EventSub присылает их в нижнем
+        streamer = streamer.lower()
+        with self._lock:
+            return self._start_recording(streamer, quality, filename_template)
+
+    def _start_recording(self, streamer: str, quality: str, filename_template: str) -> bool:
+        """Начать запись стрима, вызывается под self._lock"""
         # Проверка что запись уже не идет
         if streamer in self.active_recordings:
-            self.logger.warning(f"Запись {streamer} уже активна")
+            self.logger.warning("Запись %s уже активна", streamer)
             return False
 
+        if not self._streamlink_path:
+            # Возможно, streamlink установили после запуска
+            self._streamlink_path = shutil.which("streamlink")
+            if not self._streamlink_path:
+                self.logger.error("Не удалось начать запись %s: streamlink не найден", streamer)
+                return False
+
+        # Одно время старта для имени файла, лога и информации о записи
+        now = datetime.now()
+
         # Генерация имени файла
-        filename = self._generate_filename(streamer, filename_template)
+        filename = self._generate_filename(streamer, filename_template, now)
         output_path = self.recordings_dir / filename
 
         # Создание URL
@@ -73,7 +261,7 @@ class StreamRecorder:
 
         # Команда streamlink
         cmd = [
-            "streamlink",
+            self._streamlink_path,
             "--twitch-disable-ads",
             "--twitch-low-latency",
             stream_url,
@@ -84,117 +272,193 @@ class StreamRecorder:
         ]
 
         # Путь к лог файлу
-        log_file_path = self.logs_dir / f"{streamer}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+        log_file_path = self.logs_dir / f"{streamer}_{now.strftime('%Y%m%d_%H%M%S')}.log"
 
         try:
-            # Запуск процесса
-            with open(log_file_path, 'w', encoding='utf-8') as log_file:
+            # Запуск процесса. Лог пишет только дочерний процесс, поэтому файл
+            # открывается в бинарном режиме без текстовой обертки
+            with open(log_file_path, 'wb') as log_file:
                 process = subprocess.Popen(
                     cmd,
                     stdout=log_file,
                     stderr=subprocess.STDOUT,
-                    preexec_fn=os.setsid if os.name != 'nt' else None
+                    start_new_session=(os.name != 'nt')
                 )
 
             self.active_recordings[streamer] = {
                 'process': process,
                 'output_path': output_path,
                 'log_path': log_file_path,
-                'start_time': datetime.now(),
+                # Строковые пути для отображения, чтобы не форматировать их при каждом обновлении
+                'output_path_str': str(output_path),
+                'log_path_str': str(log_file_path),
+                'start_time': now,
+                'start_time_str': now.strftime('%Y-%m-%d %H:%M:%S'),
                 'quality': quality
             }
+            self._watch_process(streamer, process)
 
-            self.logger.info(f"Начата запись {streamer} в {output_path}")
+            self.logger.info("Начата запись %s в %s", streamer, output_path)
             return True
 
         except Exception as e:
-            self.logger.error(f"Ошибка при запуске записи {streamer}: {e}")
+            self.logger.error("Ошибка при запуске записи %s: %s", streamer, e)
             return False
 
     def stop_recording(self, streamer: str) -> bool:
         """Остановить запись стрима"""
-        if streamer not in self.active_recordings:
-            self.logger.warning(f"Активной записи {streamer} не найдено")
-            return False
+        streamer = streamer.lower()
+        # Запись забирается под блокировкой, а ожидание процесса идет без нее,
+        # чтобы не задерживать остальные потоки на время остановки
+        with self._lock:
+            if streamer not in self.active_recordings:
+                self.logger.warning("Активной записи %s не найдено", streamer)
+                return False
+            recording, fd = self._detach_recording(streamer)
 
-        recording = self.active_recordings[streamer]
         process = recording['process']
 
         try:
             # Корректная остановка процесса
-            if os.name != 'nt':
-                os.killpg(os.getpgid(process.pid), signal.SIGTERM)
-            else:
-                process.terminate()
+            self._terminate(process)
 
             # Ожидание завершения
-            process.wait(timeout=10)
+            self._wait_with_timeout(process, fd, self.STOP_TIMEOUT)
 
-            self.logger.info(f"Запись {streamer} остановлена")
-            del self.active_recordings[streamer]
+            self.logger.info("Запись %s остановлена", streamer)
+            return True
+
+        except ProcessLookupError:
+            # Процесс уже завершился
+            process.wait()
+            self.logger.info("Запись %s остановлена", streamer)
             return True
 
         except subprocess.TimeoutExpired:
             # Принудительное завершение
-            if os.name != 'nt':
-                os.killpg(os.getpgid(process.pid), signal.SIGKILL)
-            else:
-                process.kill()
-
-            del self.active_recordings[streamer]
-            self.logger.warning(f"Запись {streamer} принудительно остановлена")
+            try:
+                self._kill(process)
+            except ProcessLookupError:
+                pass
+            # Забрать код возврата, чтобы не оставить зомби
+            process.wait()
+
+            self.logger.warning("Запись %s принудительно остановлена", streamer)
             return True
 
         except Exception as e:
-            self.logger.error(f"Ошибка при остановке записи {streamer}: {e}")
+            self.logger.error("Ошибка при остановке записи %s: %s", streamer, e)
+            # Процесс мог остаться работать - вернуть запись в список активных
+            with self._lock:
+                if streamer not in self.active_recordings:
+                    self.active_recordings[streamer] = recording
+                    self._watch_process(streamer, process)
             return False
 
+        finally:
+            if fd is not None:
+                os.close(fd)
+
     def is_recording(self, streamer: str) -> bool:
         """Проверить идет ли запись"""
-        if streamer not in self.active_recordings:
-            return False
-
-        recording = self.active_recordings[streamer]
-        process = recording['process']
-
-        # Проверка статуса процесса
-        if process.poll() is not None:
-            # Процесс завершен
-            del self.active_recordings[streamer]
-            return False
-
-        return True
+        streamer = streamer.lower()
+        with self._lock:
+            # Очистить завершенные записи
+            self._reap_finished()
+            return streamer in self.active_recordings
 
     def get_active_recordings(self) -> Dict[str, Dict]:
         """Получить список активных записей"""
-        # Очистить завершенные записи
-        finished = []
-        for streamer, recording in self.active_recordings.items():
-            if recording['process'].poll() is not None:
-                finished.append(streamer)
+        with self._lock:
+            # Очистить завершенные записи
+            self._reap_finished()
+            # Снимок словаря: фоновый мониторинг может менять его во время обхода
+            return dict(self.active_recordings)
 
-        for streamer in finished:
-            del self.active_recordings[streamer]
+    def stop_all_recordings(self):
+        """Остановить все активные записи
+
+        SIGTERM отправляется всем процессам сразу, а завершения ожидаются
+        параллельно с общим таймаутом, а не по очереди.
+        """
+        with self._lock:
+            detached = {
+                streamer: self._detach_recording(streamer)
+                for streamer in list(self.active_recordings)
+            }
 
-        return self.active_recordings.copy()
+        pending: Dict[str, subprocess.Popen] = {}
+        pidfds: Dict[str, int] = {}
+        for streamer, (recording, fd) in detached.items():
+            if fd is not None:
+                pidfds[streamer] = fd
+            process = recording['process']
+            try:
+                self._terminate(process)
+            except ProcessLookupError:
+                # Процесс уже завершился
+                pass
+            except Exception as e:
+                self.logger.error("Ошибка при остановке записи %s: %s", streamer, e)
+                continue
+            pending[streamer] = process
 
-    def stop_all_recordings(self):
-        """Остановить все активные записи"""
-        streamers = list(self.active_recordings.keys())
-        for streamer in streamers:
-            self.stop_recording(streamer)
+        try:
+            deadline = time.monotonic() + self.STOP_TIMEOUT
+            while pending:
+                for streamer, process in list(pending.items()):
+                    # Ошибка по одной записи не должна оставить работать остальные
+                    try:
+                        if process.poll() is None:
+                            continue
+                        self.logger.info("Запись %s остановлена", streamer)
+                    except Exception as e:
+                        self.logger.error("Ошибка при остановке записи %s: %s", streamer, e)
+                    del pending[streamer]
+
+                remaining = deadline - time.monotonic()
+                if not pending or remaining <= 0:
+                    break
+
+                if all(streamer in pidfds for streamer in pending):
+                    # Проснуться сразу, как только завершится любой из процессов
+                    select.select([pidfds[streamer] for streamer in pending], [], [], remaining)
+                else:
+                    time.sleep(min(0.05, remaining))
+
+            # Принудительное завершение оставшихся
+            killed = []
+            for streamer, process in pending.items():
+                try:
+                    self._kill(process)
+                except ProcessLookupError:
+                    pass
+                except Exception as e:
+                    self.logger.error("Ошибка при остановке записи %s: %s", streamer, e)
+                    continue
+                killed.append((streamer, process))
+
+            # Забрать коды возврата после SIGKILL, чтобы не оставить зомби
+            for streamer, process in killed:
+                process.wait()
+                self.logger.warning("Запись %s принудительно остановлена", streamer)
+        finally:
+            for fd in pidfds.values():
+                os.close(fd)
 
     def get_recording_info(self, streamer: str) -> Optional[Dict]:
         """Получить информацию о записи"""
-        if streamer not in self.active_recordings:
+        streamer = streamer.lower()
+        with self._lock:
+            recording = self.active_recordings.get(streamer)
+        if recording is None:
             return None
 
-        recording = self.active_recordings[streamer]
-
-        # Получить размер файла
-        file_size = 0
-        if recording['output_path'].exists():
-            file_size = recording['output_path'].stat().st_size
+        # Получить размер файла (один stat вместо exists() + stat())
+        try:
+            file_size = os.stat(recording['output_path_str']).st_size
+        except OSError:
+            file_size = 0
 
         # Время записи
         duration = datetime.now() - recording['start_time']
@@ -202,9 +466,9 @@ class StreamRecorder:
         return {
             'streamer': streamer,
             'quality': recording['quality'],
-            'output_path': str(recording['output_path']),
-            'log_path': str(recording['log_path']),
+            'output_path': recording['output_path_str'],
+            'log_path': recording['log_path_str'],
             'file_size': file_size,
             'duration': str(duration).split('.')[0],  # Убрать микросекунды
-            'start_time': recording['start_time'].strftime('%Y-%m-%d %H:%M:%S')
+            'start_time': recording['start_time_str']
         }
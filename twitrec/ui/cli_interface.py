@@ -17,6 +17,15 @@ import time
 class CLIInterface:
     """Класс для красивого отображения CLI интерфейса"""
 
+    # Колонки таблицы активных записей: (заголовок, параметры колонки)
+    RECORDINGS_COLUMNS = (
+        ("Стример", {'style': "green", 'no_wrap': True}),
+        ("Качество", {'style': "blue"}),
+        ("Время", {'style': "yellow"}),
+        ("Размер", {'style': "magenta"}),
+        ("Старт", {'style': "cyan"}),
+    )
+
     def __init__(self):
         self.console = Console()
 
@@ -120,12 +129,8 @@ class CLIInterface:
             Panel(info_table, title="[bold blue]ℹ️  Информация о канале[/]", border_style="blue")
         )
 
-    def show_active_recordings(self, recordings: Dict[str, Dict]):
-        """Показать активные записи"""
-        if not recordings:
-            self.console.print("\n[yellow]Нет активных записей[/]")
-            return
-
+    def _build_recordings_table(self, recordings: Dict[str, Dict]) -> Table:
+        """Построить таблицу активных записей"""
         table = Table(
             title="[bold]📹 Активные записи[/]",
             box=box.ROUNDED,
@@ -134,23 +139,29 @@ class CLIInterface:
             header_style="bold cyan"
         )
 
-        table.add_column("Стример", style="green", no_wrap=True)
-        table.add_column("Качество", style="blue")
-        table.add_column("Время", style="yellow")
-        table.add_column("Размер", style="magenta")
-        table.add_column("Старт", style="cyan")
+        for header, options in self.RECORDINGS_COLUMNS:
+            table.add_column(header, **options)
 
         for streamer, info in recordings.items():
-            file_size_mb = info['file_size'] / (1024 * 1024)
+            # Размер в сотых долях МБ, целочисленно
+            file_size_cmb = (info['file_size'] * 100) >> 20
             table.add_row(
                 streamer,
                 info['quality'],
                 info['duration'],
-                f"{file_size_mb:.2f} MB",
+                f"{file_size_cmb // 100}.{file_size_cmb % 100:02d} MB",
                 info['start_time']
             )
 
-        self.console.print("\n", table)
+        return table
+
+    def show_active_recordings(self, recordings: Dict[str, Dict]):
+        """Показать активные записи"""
+        if not recordings:
+            self.console.print("\n[yellow]Нет активных записей[/]")
+            return
+
+        self.console.print("\n", self._build_recordings_table(recordings))
 
     def show_search_results(self, channels: List[Dict]):
         """Показать результаты поиска каналов"""
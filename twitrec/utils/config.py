@@ -2,14 +2,22 @@
 Модуль управления конфигурацией TwitRec
 """
 import os
-import json
+import atexit
+import logging
+import threading
 from pathlib import Path
 from typing import Optional, Dict, Any
 from dotenv import load_dotenv
 
+from twitrec.utils import jsonlib
+from twitrec.utils.fs import write_atomic
+
 class Config:
     """Класс для управления конфигурацией приложения"""
 
+    # Задержка записи на диск после set(): серия изменений сохраняется одной записью
+    SAVE_DELAY = 0.25
+
     def __init__(self):
         self.config_dir = Path.home() / ".twitrec"
         self.config_file = self.config_dir / "config.json"
@@ -23,12 +31,17 @@ class Config:
             load_dotenv(self.env_file)
 
         self.config = self._load_config()
+        self.logger = logging.getLogger(__name__)
+
+        self._dirty = False
+        self._save_timer: Optional[threading.Timer] = None
+        self._save_lock = threading.Lock()
+        atexit.register(self.flush)
 
     def _load_config(self) -> Dict[str, Any]:
         """Загрузить конфигурацию из файла"""
         if self.config_file.exists():
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return jsonlib.loads(self.config_file.read_bytes())
 
         # Дефолтная конфигурация
         return {
@@ -36,13 +49,50 @@ class Config:
             "logs_dir": str(Path.cwd() / "logs"),
             "default_quality": "best",
             "check_interval": 60,  # секунды
+            "use_eventsub": False,  # EventSub вместо опроса API (нужна авторизация пользователя)
             "filename_template": "{streamer}_{date}_{time}.mp4"
         }
 
     def save_config(self):
         """Сохранить конфигурацию в файл"""
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            json.dump(self.config, f, indent=4, ensure_ascii=False)
+        with self._save_lock:
+            self._write_config()
+
+    def flush(self):
+        """Записать отложенные изменения конфигурации на диск"""
+        with self._save_lock:
+            if self._dirty:
+                self._write_config()
+
+    def _write_config(self):
+        """Записать конфигурацию на диск, вызывается под self._save_lock"""
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+            self._save_timer = None
+
+        # Атомарная запись: при сбое на диске остается старая версия целиком
+        write_atomic(self.config_file, jsonlib.dumps(self.config, indent=True))
+        # Флаг снимается только после успешной записи, иначе изменения
+        # останутся для следующего flush()
+        self._dirty = False
+
+    def _deferred_save(self):
+        """Отложенное сохранение из потока таймера"""
+        try:
+            self.flush()
+        except Exception as e:
+            self.logger.error("Не удалось сохранить конфигурацию: %s", e)
+
+    def _schedule_save(self):
+        """Отложить сохранение конфигурации на SAVE_DELAY секунд"""
+        with self._save_lock:
+            self._dirty = True
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+
+            self._save_timer = threading.Timer(self.SAVE_DELAY, self._deferred_save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
 
     def get_twitch_credentials(self) -> tuple[Optional[str], Optional[str]]:
         """Получить Twitch API креденшалы"""
@@ -69,7 +119,7 @@ TWITCH_CLIENT_SECRET={client_secret}
     def set(self, key: str, value: Any):
         """Установить значение в конфигурации"""
         self.config[key] = value
-        self.save_config()
+        self._schedule_save()
 
     def ensure_directories(self):
         """Убедиться что все необходимые директории существуют"""
@@ -0,0 +1,29 @@
+"""
+Работа с файлами
+"""
+import os
+from pathlib import Path
+
+
+def write_atomic(path: Path, data: bytes, mode: int = 0o644):
+    """Атомарно записать файл через временный файл и os.replace
+
+    При сбое на диске остается старая версия файла целиком. mode задает
+    права нового файла, например 0o600 для файлов с секретами.
+    """
+    tmp_file = path.with_suffix('.tmp')
+    # Временный файл, оставшийся после сбоя, сохранил бы свои старые права:
+    # O_CREAT применяет mode только к новому файлу
+    try:
+        os.unlink(tmp_file)
+    except FileNotFoundError:
+        pass
+
+    fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+        f.flush()
+        # Данные должны быть на диске до os.replace, иначе после сбоя
+        # питания на месте файла может оказаться пустой
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
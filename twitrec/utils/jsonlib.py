@@ -0,0 +1,26 @@
+"""
+Быстрая работа с JSON: orjson, если установлен, иначе стандартный json
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data: bytes):
+    """Разобрать JSON из bytes или str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, indent: bool = False) -> bytes:
+    """Сериализовать объект в JSON (UTF-8 bytes)
+
+    indent=True включает форматирование с отступом в 2 пробела.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode('utf-8')
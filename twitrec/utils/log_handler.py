@@ -0,0 +1,30 @@
+"""
+Буферизованный файловый обработчик логов
+"""
+import logging
+
+
+class BufferedFileHandler(logging.FileHandler):
+    """FileHandler, который не сбрасывает файл на диск после каждой записи
+
+    Данные уходят на диск при заполнении буфера или явном вызове flush().
+    Файл открывается только при первой записи.
+    """
+
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, filename, mode='a', encoding=None):
+        super().__init__(filename, mode=mode, encoding=encoding, delay=True)
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, encoding=self.encoding, buffering=self.BUFFER_SIZE)
+
+    def emit(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+
+        try:
+            msg = self.format(record)
+            self.stream.write(msg + self.terminator)
+        except Exception:
+            self.handleError(record)